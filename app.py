@@ -1,10 +1,12 @@
 import streamlit as st
-import google.generativeai as genai
-from docx import Document
 from PIL import Image
+import diskcache
+import hashlib
 import io
 import os
-from datetime import datetime
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 # Configure page
 st.set_page_config(
@@ -13,43 +15,168 @@ st.set_page_config(
     layout="wide"
 )
 
+MODEL_ID = 'models/gemini-2.5-flash'
+
+# Gemini tiles images at 768px, so larger uploads only cost bandwidth and tokens
+MAX_IMAGE_EDGE = 1568
+
+# Bump whenever prepare_image changes, so cached responses for the old output are not reused
+PREPARE_IMAGE_VERSION = 2
+
+# Upper bound on Gemini requests in flight when extracting several images
+MAX_CONCURRENT_EXTRACTIONS = 4
+
+# Re-upload an image this long before its File API handle expires (uploads last 48 hours)
+UPLOAD_EXPIRY_MARGIN = timedelta(minutes=10)
+
+# Markdown patterns used when building the Word document
+# Heading level and text, dropping a closing run of # that starts after whitespace
+_HEADING = re.compile(r'^(#{1,3})\s*(.*?)(?:\s*(?<!\S)#+)?$')
+_DIGITS = frozenset('123456789')
+# Characters of a table separator row; deleting them leaves nothing for separators
+_SEP_DELETE = str.maketrans('', '', '|:-= ')
+_BOLD = re.compile(r'\*\*(.*?)\*\*')
+
+PROMPTS = {
+    "comprehensive": """
+    Please extract ALL text content from this image. Include:
+    1. All visible text (headings, paragraphs, captions, labels)
+    2. Any structured data (tables, lists, forms)
+    3. Text in different fonts, sizes, or styles
+    4. Preserve the original formatting and structure as much as possible
+    5. Include any numbers, dates, or special characters
+    
+    Format the output in a clear, readable way that maintains the document's structure.
+    """,
+    "ocr_only": "Extract only the text content from this image, preserving line breaks and structure.",
+    "structured": "Extract text from this image and organize it with clear headings and sections."
+}
+
 def configure_gemini():
     """Configure Gemini API with user's API key"""
+    # Imported lazily; the client pulls in grpc/protobuf, which slows the first page render
+    import google.generativeai as genai
+    
     api_key = st.session_state.get('api_key', '')
     if api_key:
         genai.configure(api_key=api_key)
         return True
     return False
 
-def extract_text_from_image(image, prompt_type="comprehensive"):
-    """Extract text from image using Gemini Vision API"""
-    try:
-        # Use Gemini 1.5 Flash model
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
-        
-        prompts = {
-            "comprehensive": """
-            Please extract ALL text content from this image. Include:
-            1. All visible text (headings, paragraphs, captions, labels)
-            2. Any structured data (tables, lists, forms)
-            3. Text in different fonts, sizes, or styles
-            4. Preserve the original formatting and structure as much as possible
-            5. Include any numbers, dates, or special characters
-            
-            Format the output in a clear, readable way that maintains the document's structure.
-            """,
-            "ocr_only": "Extract only the text content from this image, preserving line breaks and structure.",
-            "structured": "Extract text from this image and organize it with clear headings and sections."
-        }
-        
-        response = model.generate_content([prompts[prompt_type], image])
-        return response.text
-    except Exception as e:
-        st.error(f"Error extracting text: {str(e)}")
-        return None
+@st.cache_resource(show_spinner=False)
+def _get_cache():
+    """Open the persistent cache of Gemini responses once per process.
+    
+    Entries are keyed by image content + prompt + preprocessing + model. Opening
+    the cache runs diskcache's SQLite setup, so it must not happen on every rerun.
+    """
+    return diskcache.Cache(".gemini_ocr_cache")
+
+@st.cache_resource
+def _get_model(model_id: str, api_key: str):
+    """Build the Gemini model once per API key and reuse it across reruns.
+    
+    The model keeps the client of the key configured when it first generates
+    content, so the key is part of the cache key.
+    """
+    import google.generativeai as genai
+    
+    return genai.GenerativeModel(model_id)
 
+@st.cache_data(ttl=3600)
+def _list_vision_models(api_key: str):
+    """List models supporting generateContent, cached per API key to avoid a request on every rerun"""
+    import google.generativeai as genai
+    
+    return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+def prepare_image(image):
+    """Downscale and recompress an image, returning JPEG bytes ready for upload"""
+    # JPEG has no alpha channel, so composite transparent images onto white;
+    # transparent pixels are often stored as black and would hide dark text
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    else:
+        image = image.copy()
+    
+    if max(image.size) > MAX_IMAGE_EDGE:
+        image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
+def upload_image(image):
+    """Upload an image to the Gemini File API and return the file handle"""
+    import google.generativeai as genai
+    
+    return genai.upload_file(io.BytesIO(prepare_image(image)), mime_type='image/jpeg')
+
+def extract_text_from_image(model, image, image_bytes, prompt_type, gemini_files):
+    """Extract text from image using Gemini Vision API.
+    
+    Runs on worker threads, so errors are raised rather than reported through Streamlit.
+    """
+    # Reuse a previous response for the same image, prompt text, preprocessing and model
+    key = hashlib.sha256(
+        image_bytes + f"{PROMPTS[prompt_type]}|{PREPARE_IMAGE_VERSION}|{MODEL_ID}".encode()
+    ).hexdigest()
+    cache = _get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    
+    # Upload each image once per session and API key and reuse the handle across modes;
+    # uploads expire on the server, so upload again once the handle is about to lapse
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    image_file = gemini_files.get(image_digest)
+    expires = image_file.expiration_time if image_file is not None else None
+    if image_file is None or (expires and expires <= datetime.now(timezone.utc) + UPLOAD_EXPIRY_MARGIN):
+        image_file = gemini_files[image_digest] = upload_image(image)
+    
+    # Static prompt first, image last, so the request prefix stays identical across calls
+    response = model.generate_content([PROMPTS[prompt_type], image_file])
+    # Empty responses count as failures, so leave them uncached to allow a retry
+    if response.text:
+        cache.set(key, response.text)
+    return response.text
+
+def extract_text_from_images(images, prompt_type="comprehensive"):
+    """Extract text from (image, image_bytes) pairs concurrently, returning results in order"""
+    # Use Gemini 2.5 Flash model
+    model = _get_model(MODEL_ID, st.session_state.api_key)
+    # Uploaded files belong to the project of the key that uploaded them
+    gemini_files = st.session_state.setdefault('gemini_files', {}).setdefault(st.session_state.api_key, {})
+    
+    # Each extraction is a blocking network call, so threads let them overlap
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_EXTRACTIONS) as executor:
+        futures = [
+            executor.submit(extract_text_from_image, model, image, image_bytes, prompt_type, gemini_files)
+            for image, image_bytes in images
+        ]
+    
+    texts = []
+    for future in futures:
+        try:
+            texts.append(future.result())
+        except Exception as e:
+            st.error(f"Error extracting text: {str(e)}")
+            texts.append(None)
+    return texts
+
+@st.cache_data(max_entries=8, ttl=60)
 def create_word_document(extracted_text, filename="extracted_text.docx"):
-    """Create a Word document with the extracted text, parsing markdown formatting"""
+    """Create a Word document with the extracted text, parsing markdown formatting.
+    
+    Returns the .docx file as bytes; results are cached per text so reruns reuse them.
+    The short TTL keeps the "Generated on" timestamp in the cached bytes current.
+    """
+    from docx import Document
+    
     doc = Document()
     
     # Add title
@@ -62,66 +189,53 @@ def create_word_document(extracted_text, filename="extracted_text.docx"):
     # Add extracted content header
     doc.add_heading('Extracted Content', level=1)
     
-    # Parse and format the extracted text
-    lines = extracted_text.split('\n')
+    # Resolve styles once; passing style objects skips a by-name lookup per paragraph
+    heading_styles = {level: doc.styles[f'Heading {level}'] for level in (1, 2, 3)}
+    bullet_style = doc.styles['List Bullet']
+    number_style = doc.styles['List Number']
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
+    # Parse and format the extracted text in one pass over the lines;
+    # table_lines collects rows while inside a markdown table
+    table_lines = None
+    
+    for line in (raw_line.strip() for raw_line in extracted_text.splitlines()):
+        if table_lines is not None:
+            if line.startswith('|'):
+                # Skip separator lines (like | :--- | :--- |)
+                if line.translate(_SEP_DELETE):
+                    table_lines.append(line)
+                continue
+            
+            # The first non-table line ends the table
+            if table_lines:
+                create_word_table(doc, table_lines)
+            table_lines = None
         
         if not line:
-            i += 1
             continue
             
         # Check if this is the start of a table
         if line.startswith('|') and '|' in line[1:]:
-            # Process table
-            table_lines = []
-            j = i
-            
-            # Collect all table lines
-            while j < len(lines) and lines[j].strip().startswith('|'):
-                table_line = lines[j].strip()
-                # Skip separator lines (like | :--- | :--- |)
-                if not all(c in '|:-= ' for c in table_line):
-                    table_lines.append(table_line)
-                j += 1
-            
-            if table_lines:
-                create_word_table(doc, table_lines)
-            
-            i = j
+            table_lines = [line] if line.translate(_SEP_DELETE) else []
             continue
             
         # Handle different markdown elements
-        if line.startswith('###'):
-            # Level 3 heading
-            heading_text = line.replace('###', '').strip()
-            doc.add_heading(heading_text, level=3)
-            
-        elif line.startswith('##'):
-            # Level 2 heading
-            heading_text = line.replace('##', '').strip()
-            doc.add_heading(heading_text, level=2)
-            
-        elif line.startswith('#'):
-            # Level 1 heading
-            heading_text = line.replace('#', '').strip()
-            doc.add_heading(heading_text, level=1)
+        if heading := _HEADING.match(line):
+            # Heading, level taken from the number of leading #
+            doc.add_paragraph(heading.group(2), style=heading_styles[len(heading.group(1))])
             
         elif line.startswith('*') or line.startswith('-'):
             # Bullet point
             bullet_text = line[1:].strip()
             # Parse bold text in bullet points
             bullet_text = parse_inline_formatting(bullet_text)
-            p = doc.add_paragraph(style='List Bullet')
+            p = doc.add_paragraph(style=bullet_style)
             add_formatted_text(p, bullet_text)
             
-        elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
+        elif len(line) >= 2 and line[0] in _DIGITS and line[1] == '.':
             # Numbered list
-            num_text = line.split('.', 1)[1].strip() if '.' in line else line
-            num_text = parse_inline_formatting(num_text)
-            p = doc.add_paragraph(style='List Number')
+            num_text = parse_inline_formatting(line[2:].lstrip())
+            p = doc.add_paragraph(style=number_style)
             add_formatted_text(p, num_text)
             
         else:
@@ -130,15 +244,16 @@ def create_word_document(extracted_text, filename="extracted_text.docx"):
                 formatted_text = parse_inline_formatting(line)
                 p = doc.add_paragraph()
                 add_formatted_text(p, formatted_text)
-        
-        i += 1
+    
+    # Flush a table that runs to the end of the text
+    if table_lines:
+        create_word_table(doc, table_lines)
     
     # Save to bytes buffer
     doc_buffer = io.BytesIO()
     doc.save(doc_buffer)
-    doc_buffer.seek(0)
     
-    return doc_buffer
+    return doc_buffer.getvalue()
 
 def create_word_table(doc, table_lines):
     """Create a Word table from markdown table lines"""
@@ -168,60 +283,46 @@ def create_word_table(doc, table_lines):
     table.style = 'Table Grid'
     
     # Fill table data
-    for row_idx, row_data in enumerate(table_data):
-        for col_idx, cell_data in enumerate(row_data):
-            if col_idx < len(table.rows[row_idx].cells):
-                cell = table.rows[row_idx].cells[col_idx]
-                
-                # Parse formatting for cell content
-                formatted_text = parse_inline_formatting(cell_data)
-                
-                # Clear existing content
-                cell.text = ''
-                
-                # Add formatted content
-                paragraph = cell.paragraphs[0]
-                add_formatted_text(paragraph, formatted_text)
-                
-                # Make header row bold
-                if row_idx == 0:
-                    for run in paragraph.runs:
-                        run.bold = True
+    for row_idx, (row, row_data) in enumerate(zip(table.rows, table_data)):
+        # row.cells rebuilds the cell grid, so fetch it once per row;
+        # zip also drops any cells beyond the header's column count
+        for cell, cell_data in zip(row.cells, row_data):
+            # Parse formatting for cell content
+            formatted_text = parse_inline_formatting(cell_data)
+            
+            # A new cell already holds one empty paragraph, so write into it directly
+            paragraph = cell.paragraphs[0]
+            add_formatted_text(paragraph, formatted_text)
+            
+            # Make header row bold
+            if row_idx == 0:
+                for run in paragraph.runs:
+                    run.bold = True
     
     # Add some spacing after table
     doc.add_paragraph("")
 
 def parse_inline_formatting(text):
-    """Parse inline markdown formatting like **bold** and return formatted segments"""
+    """Parse inline markdown formatting like **bold** and return formatted segments.
+    
+    Text without any bold marker is returned unchanged as a plain string.
+    """
+    if '**' not in text:
+        return text
+    
     segments = []
     current_pos = 0
     
-    while current_pos < len(text):
-        # Find next bold marker
-        bold_start = text.find('**', current_pos)
-        
-        if bold_start == -1:
-            # No more bold text, add remaining as normal
-            if current_pos < len(text):
-                segments.append(('normal', text[current_pos:]))
-            break
-            
-        # Add text before bold as normal
-        if bold_start > current_pos:
-            segments.append(('normal', text[current_pos:bold_start]))
-        
-        # Find end of bold text
-        bold_end = text.find('**', bold_start + 2)
-        if bold_end == -1:
-            # No closing **, treat as normal text
-            segments.append(('normal', text[bold_start:]))
-            break
-            
-        # Add bold text
-        bold_text = text[bold_start + 2:bold_end]
-        segments.append(('bold', bold_text))
-        
-        current_pos = bold_end + 2
+    # Single pass over the text, alternating normal and bold segments
+    for match in _BOLD.finditer(text):
+        if match.start() > current_pos:
+            segments.append(('normal', text[current_pos:match.start()]))
+        segments.append(('bold', match.group(1)))
+        current_pos = match.end()
+    
+    # Trailing text, including any unclosed ** marker, stays normal
+    if current_pos < len(text):
+        segments.append(('normal', text[current_pos:]))
     
     return segments
 
@@ -239,7 +340,7 @@ def add_formatted_text(paragraph, formatted_segments):
 
 def main():
     st.title("📄 Image Text Extractor")
-    st.markdown("Upload an image and extract all text content into an editable Word document using Google Gemini AI.")
+    st.markdown("Upload one or more images and extract all text content into an editable Word document using Google Gemini AI.")
     
     # Sidebar for API configuration
     with st.sidebar:
@@ -261,11 +362,10 @@ def main():
                 # Show available models for debugging
                 if st.checkbox("Show available models"):
                     try:
-                        models = genai.list_models()
-                        vision_models = [m for m in models if 'generateContent' in m.supported_generation_methods]
+                        vision_models = _list_vision_models(api_key)
                         st.write("Available vision models:")
-                        for model in vision_models[:5]:  # Show first 5
-                            st.write(f"- {model.name}")
+                        for model_name in vision_models[:5]:  # Show first 5
+                            st.write(f"- {model_name}")
                     except Exception as e:
                         st.write(f"Error listing models: {e}")
             else:
@@ -287,43 +387,61 @@ def main():
     with col1:
         st.header("📤 Upload Image")
         
-        uploaded_file = st.file_uploader(
-            "Choose an image file",
+        uploaded_files = st.file_uploader(
+            "Choose image files",
             type=['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'],
-            help="Upload an image containing text to extract"
+            accept_multiple_files=True,
+            help="Upload one or more images containing text to extract"
         )
         
-        if uploaded_file is not None:
+        images = []
+        for uploaded_file in uploaded_files:
             # Display uploaded image
             image = Image.open(uploaded_file)
-            st.image(image, caption="Uploaded Image", use_column_width=True)
+            st.image(image, caption=uploaded_file.name, use_column_width=True)
             
             # Image info
             st.info(f"📊 Image size: {image.size[0]} x {image.size[1]} pixels")
+            
+            images.append((image, uploaded_file.getvalue()))
+    
+    # Results are kept per (uploaded images, mode), so switching back to a
+    # mode that was already extracted needs no new request
+    results = st.session_state.setdefault('results', {})
+    image_key = tuple(hashlib.md5(image_bytes).digest() for _, image_bytes in images)
+    results_key = (image_key, prompt_type)
     
     with col2:
         st.header("📝 Extracted Text")
         
-        if uploaded_file is not None and st.session_state.get('api_key'):
+        if images and st.session_state.get('api_key'):
             if st.button("🚀 Extract Text", type="primary"):
-                with st.spinner("Extracting text from image..."):
-                    # Extract text
-                    extracted_text = extract_text_from_image(image, prompt_type)
+                with st.spinner("Extracting text from images..."):
+                    # Extract text from all images concurrently
+                    texts = extract_text_from_images(images, prompt_type)
                     
-                    if extracted_text:
-                        st.session_state.extracted_text = extracted_text
+                    if all(texts):
+                        if len(texts) == 1:
+                            extracted_text = texts[0]
+                        else:
+                            # One section per image, headed by its file name
+                            extracted_text = "\n\n".join(
+                                f"## {uploaded_file.name}\n\n{text}"
+                                for uploaded_file, text in zip(uploaded_files, texts)
+                            )
+                        results[results_key] = extracted_text
                         st.success("✅ Text extracted successfully!")
                     else:
                         st.error("❌ Failed to extract text")
         
-        # Display extracted text if available
-        if 'extracted_text' in st.session_state:
+        # Display extracted text if available for the current images and mode
+        if results_key in results:
             st.subheader("Extracted Content")
             
             # Editable text area
             edited_text = st.text_area(
                 "Edit the extracted text:",
-                value=st.session_state.extracted_text,
+                value=results[results_key],
                 height=400,
                 help="You can edit the extracted text before downloading"
             )
@@ -336,10 +454,10 @@ def main():
             with col_download1:
                 # Download as Word document
                 if st.button("📄 Download as Word"):
-                    doc_buffer = create_word_document(edited_text)
+                    doc_bytes = create_word_document(edited_text)
                     st.download_button(
                         label="💾 Download DOCX",
-                        data=doc_buffer.getvalue(),
+                        data=doc_bytes,
                         file_name=f"extracted_text_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx",
                         mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
                     )